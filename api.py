@@ -1,16 +1,31 @@
 from __future__ import annotations
 
+import hashlib
+import logging
+import os
+from contextlib import asynccontextmanager
 from decimal import Decimal
-from typing import Iterator, List, Optional
-
-from fastapi import Depends, FastAPI, HTTPException, status
-from pydantic import BaseModel, Field, ConfigDict
+from functools import partial
+from typing import Annotated, Any, AsyncIterator, Iterator, List, Optional
+
+import orjson
+
+from anyio import from_thread
+from fastapi import Depends, FastAPI, HTTPException, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from fastapi_cache import Coder, FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.decorator import cache
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter
+from redis import asyncio as aioredis
 from sqlalchemy import select
-from sqlalchemy.orm import Session, selectinload, sessionmaker
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, raiseload, selectinload, sessionmaker
 
 from db_setup import (
     Alergeno,
-    Base,
     BdCardapioSemanal,
     BdIngrediente,
     BdPratoIngrediente,
@@ -18,12 +33,25 @@ from db_setup import (
     DB_PATH,
     Macronutriente,
     criar_engine,
+    criar_tabelas,
+    para_centesimos,
 )
 
+logger = logging.getLogger(__name__)
+
 engine = criar_engine()
-Base.metadata.create_all(engine)
+criar_tabelas(engine)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False, future=True)
 
+# Com STRICT_LOADING=1 qualquer lazy load não planejado levanta erro em vez de disparar N consultas.
+CARREGAMENTO_ESTRITO = os.getenv("STRICT_LOADING", "").lower() in {"1", "true", "sim"}
+
+# Política de expiração por endpoint (segundos): dados que mudam pouco ficam mais tempo em cache.
+CACHE_EXPIRACAO = {
+    "curto": 30,
+    "normal": 60,
+}
+
 ENDPOINTS_OVERVIEW = [
     {
         "secao": "Ingredientes",
@@ -83,10 +111,36 @@ ENDPOINTS_OVERVIEW = [
     },
 ]
 
+
+class OrjsonCoder(Coder):
+    """Codifica as respostas guardadas no cache com orjson no lugar do `json` da biblioteca padrão."""
+
+    @classmethod
+    def encode(cls, value: Any) -> bytes:
+        return orjson.dumps(value, default=jsonable_encoder)
+
+    @classmethod
+    def decode(cls, value: bytes) -> Any:
+        return orjson.loads(value)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    """Inicializa o cache de respostas (Redis se `REDIS_URL` estiver definido, senão em memória)."""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        backend = RedisBackend(aioredis.from_url(redis_url))
+    else:
+        backend = InMemoryBackend()
+    FastAPICache.init(backend, prefix="jandyr", coder=OrjsonCoder)
+    yield
+
+
 app = FastAPI(
     title="Cardápio Semanal API",
     version="1.0.0",
     description="API para gestão de ingredientes, refeições e cardápio semanal.",
+    lifespan=lifespan,
 )
 
 
@@ -98,39 +152,74 @@ def get_db() -> Iterator[Session]:
         db.close()
 
 
+def _opcoes_carregamento(*opcoes):
+    """Anexa `raiseload("*")` aos carregamentos explícitos quando o modo estrito está ativo."""
+    if CARREGAMENTO_ESTRITO:
+        return (*opcoes, raiseload("*", sql_only=True))
+    return opcoes
+
+
+def _invalidar_cache(namespace: str) -> None:
+    """Limpa um namespace do cache a partir de um endpoint síncrono (executado no threadpool)."""
+    # Melhor esforço, como o `@cache`: a escrita já foi confirmada; se o backend falhar, a entrada expira pelo TTL.
+    try:
+        from_thread.run(partial(FastAPICache.clear, namespace=namespace))
+    except Exception:
+        logger.warning("Falha ao limpar o cache do namespace %s", namespace, exc_info=True)
+
+
+def _violou_unicidade(exc: IntegrityError) -> bool:
+    """Distingue nomes duplicados (índices UNIQUE) das demais restrições, como os CHECKs de valores."""
+    return "UNIQUE constraint failed" in str(exc.orig)
+
+
+def _chave_cache(func, namespace: str = "", *, request=None, response=None, args=(), kwargs=None) -> str:
+    """Gera a chave do cache a partir dos filtros da consulta, ignorando a sessão do banco."""
+    filtros = sorted((nome, valor) for nome, valor in (kwargs or {}).items() if not isinstance(valor, Session))
+    digest = hashlib.md5(repr(filtros).encode("utf-8")).hexdigest()
+    return f"{namespace}:{func.__name__}:{digest}"
+
+
+# Valor monetário/quantidade de entrada com duas casas; o banco guarda em centésimos (ver `para_centesimos`).
+ValorDecimal = Annotated[Decimal, Field(ge=Decimal("0"), max_digits=10, decimal_places=2)]
+
+
 class IngredienteBase(BaseModel):
     nome: str
-    valor_energetico: int
+    valor_energetico: int = Field(ge=0)
     alergenico: Alergeno
     macronutriente: Macronutriente
-    quantidade: Decimal = Field(..., ge=Decimal("0"), max_digits=10, decimal_places=2)
-    unidade_medida: str
-    preco_medio: Decimal = Field(..., ge=Decimal("0"), max_digits=10, decimal_places=2)
 
-    model_config = ConfigDict(from_attributes=True, use_enum_values=True, json_encoders={Decimal: lambda v: float(v)})
+    model_config = ConfigDict(from_attributes=True)
 
 
 class IngredienteCreate(IngredienteBase):
-    pass
+    quantidade: ValorDecimal
+    unidade_medida: str
+    preco_medio: ValorDecimal
 
 
 class IngredienteRead(IngredienteBase):
+    # Lidos das propriedades do modelo ORM, que convertem os centésimos inteiros direto para float.
+    quantidade: float
+    unidade_medida: str
+    preco_medio: float
     id_ingrediente: int
 
 
 class PratoIngredienteCreate(BaseModel):
     id_ingrediente: int
-    quantidade: Decimal = Field(..., ge=Decimal("0"), max_digits=10, decimal_places=2)
+    quantidade: ValorDecimal
     unidade_medida: str
 
-    model_config = ConfigDict(from_attributes=True, json_encoders={Decimal: lambda v: float(v)})
+    model_config = ConfigDict(from_attributes=True)
 
 
 class PratoIngredienteRead(BaseModel):
-    model_config = ConfigDict(from_attributes=True, json_encoders={Decimal: lambda v: float(v)})
+    model_config = ConfigDict(from_attributes=True)
 
     id_prato_ingrediente: int
-    quantidade: Decimal = Field(..., ge=Decimal("0"), max_digits=10, decimal_places=2)
+    quantidade: float
     unidade_medida: str
     ingrediente: IngredienteRead
 
@@ -140,13 +229,21 @@ class CardapioEntrada(BaseModel):
     tipo_refeicao: str
 
 
+class RefeicaoResumo(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id_refeicao: int
+    nome_prato: str
+    descricao: Optional[str]
+
+
 class CardapioRead(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
     id_cardapio_semanal: int
     dia_da_semana: str
     tipo_refeicao: str
-    refeicao: "RefeicaoResumo"
+    refeicao: RefeicaoResumo
 
 
 class RefeicaoCreate(BaseModel):
@@ -156,14 +253,6 @@ class RefeicaoCreate(BaseModel):
     cardapio: Optional[List[CardapioEntrada]] = None
 
 
-class RefeicaoResumo(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
-
-    id_refeicao: int
-    nome_prato: str
-    descricao: Optional[str]
-
-
 class RefeicaoRead(RefeicaoResumo):
     ingredientes: List[PratoIngredienteRead]
     cardapios: List[CardapioRead]
@@ -171,15 +260,32 @@ class RefeicaoRead(RefeicaoResumo):
     model_config = ConfigDict(from_attributes=True)
 
 
-# Resolver referências tardias após definir classes
-CardapioRead.model_rebuild()
-RefeicaoRead.model_rebuild()
+# Serializadores das listagens construídos uma única vez na importação.
+INGREDIENTES_ADAPTER = TypeAdapter(List[IngredienteRead])
+REFEICOES_ADAPTER = TypeAdapter(List[RefeicaoRead])
+CARDAPIO_ADAPTER = TypeAdapter(List[CardapioRead])
 
 
-@app.get("/", tags=["Meta"])
-async def raiz() -> dict[str, object]:
-    """Apresenta um guia rápido de integração para o front-end."""
-    return {
+# Quantidade de refeições carregadas e serializadas por vez em GET /refeicoes.
+REFEICOES_POR_LOTE = 100
+
+
+def _json_em_lotes(lotes, adapter: TypeAdapter) -> Iterator[bytes]:
+    """Serializa cada lote de objetos ORM como um trecho de uma única lista JSON."""
+    yield b"["
+    primeiro = True
+    for lote in lotes:
+        if not primeiro:
+            yield b","
+        # dump_json de uma lista devolve "[...]"; os colchetes externos são emitidos uma única vez.
+        yield adapter.dump_json(adapter.validate_python(lote, from_attributes=True))[1:-1]
+        primeiro = False
+    yield b"]"
+
+
+# O guia da raiz não depende de estado; é serializado uma única vez na importação.
+_RAIZ_CORPO = orjson.dumps(
+    {
         "titulo": "Cardápio Semanal API",
         "versao": app.version,
         "ambiente": {
@@ -210,120 +316,132 @@ async def raiz() -> dict[str, object]:
             "Valores numéricos suportam duas casas decimais e não aceitam negativos.",
         ],
     }
+)
+
+
+@app.get("/", tags=["Meta"])
+async def raiz() -> Response:
+    """Apresenta um guia rápido de integração para o front-end."""
+    return Response(_RAIZ_CORPO, media_type="application/json")
 
 
 @app.get("/ingredientes", response_model=List[IngredienteRead])
-async def listar_ingredientes(db: Session = Depends(get_db)) -> List[BdIngrediente]:
+@cache(expire=CACHE_EXPIRACAO["normal"], namespace="ingredientes", key_builder=_chave_cache)
+def listar_ingredientes(db: Session = Depends(get_db)) -> List[IngredienteRead]:
     stmt = select(BdIngrediente).order_by(BdIngrediente.nome)
-    return db.execute(stmt).scalars().all()
+    return INGREDIENTES_ADAPTER.validate_python(db.execute(stmt).scalars().all(), from_attributes=True)
 
 
 @app.post("/ingredientes", response_model=IngredienteRead, status_code=status.HTTP_201_CREATED)
-async def criar_ingrediente(payload: IngredienteCreate, db: Session = Depends(get_db)) -> BdIngrediente:
-    existente = db.execute(select(BdIngrediente).filter_by(nome=payload.nome)).scalars().first()
-    if existente:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Ingrediente já cadastrado")
-
+def criar_ingrediente(payload: IngredienteCreate, db: Session = Depends(get_db)) -> BdIngrediente:
     ingrediente = BdIngrediente(
         nome=payload.nome,
         valor_energetico=payload.valor_energetico,
-        alergenico=Alergeno(payload.alergenico),
-        macronutriente=Macronutriente(payload.macronutriente),
-        quantidade=Decimal(str(payload.quantidade)),
+        alergenico=payload.alergenico,
+        macronutriente=payload.macronutriente,
+        quantidade_centesimos=para_centesimos(payload.quantidade),
         unidade_medida=payload.unidade_medida,
-        preco_medio=Decimal(str(payload.preco_medio)),
+        preco_centavos=para_centesimos(payload.preco_medio),
     )
     db.add(ingrediente)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError as exc:
+        db.rollback()
+        if _violou_unicidade(exc):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Ingrediente já cadastrado") from None
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail="Dados do ingrediente inválidos"
+        ) from None
     db.refresh(ingrediente)
+    _invalidar_cache("ingredientes")
     return ingrediente
 
 
 @app.get("/refeicoes", response_model=List[RefeicaoRead])
-async def listar_refeicoes(db: Session = Depends(get_db)) -> List[BdRefeicao]:
+def listar_refeicoes(db: Session = Depends(get_db)) -> StreamingResponse:
+    # yield_per não combina com joinedload de coleções; selectinload carrega os filhos lote a lote.
     stmt = (
         select(BdRefeicao)
         .options(
-            selectinload(BdRefeicao.ingredientes).selectinload(BdPratoIngrediente.ingrediente),
-            selectinload(BdRefeicao.cardapios),
+            *_opcoes_carregamento(
+                selectinload(BdRefeicao.ingredientes).joinedload(BdPratoIngrediente.ingrediente),
+                selectinload(BdRefeicao.cardapios),
+            )
         )
         .order_by(BdRefeicao.nome_prato)
+        .execution_options(yield_per=REFEICOES_POR_LOTE)
     )
-    return db.execute(stmt).scalars().unique().all()
+    lotes = db.execute(stmt).scalars().partitions()
+    # A resposta é transmitida enquanto os lotes são lidos; o response_model continua documentando o esquema.
+    return StreamingResponse(_json_em_lotes(lotes, REFEICOES_ADAPTER), media_type="application/json")
 
 
 @app.post("/refeicoes", response_model=RefeicaoRead, status_code=status.HTTP_201_CREATED)
-async def criar_refeicao(payload: RefeicaoCreate, db: Session = Depends(get_db)) -> BdRefeicao:
+def criar_refeicao(payload: RefeicaoCreate, db: Session = Depends(get_db)) -> BdRefeicao:
     try:
-        pratos = db.execute(select(BdRefeicao).filter_by(nome_prato=payload.nome_prato)).scalars().first()
-        if pratos:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Refeição já cadastrada")
-
         if not payload.ingredientes:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Informe ao menos um ingrediente")
 
+        ids = {item.id_ingrediente for item in payload.ingredientes}
+        existentes = db.execute(select(BdIngrediente).where(BdIngrediente.id_ingrediente.in_(ids))).scalars().all()
+        ingredientes_bd = {ing.id_ingrediente: ing for ing in existentes}
+
+        # As coleções são montadas em memória; com expire_on_commit=False o objeto já serve de resposta.
         refeicao = BdRefeicao(nome_prato=payload.nome_prato, descricao=payload.descricao)
         db.add(refeicao)
-        db.flush()
 
         for item in payload.ingredientes:
-            ingrediente = db.get(BdIngrediente, item.id_ingrediente)
+            ingrediente = ingredientes_bd.get(item.id_ingrediente)
             if not ingrediente:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Ingrediente id {item.id_ingrediente} não encontrado",
                 )
-            prato_ingrediente = BdPratoIngrediente(
-                refeicao=refeicao,
-                ingrediente=ingrediente,
-                quantidade=Decimal(str(item.quantidade)),
-                unidade_medida=item.unidade_medida,
+            refeicao.ingredientes.append(
+                BdPratoIngrediente(
+                    ingrediente=ingrediente,
+                    quantidade_centesimos=para_centesimos(item.quantidade),
+                    unidade_medida=item.unidade_medida,
+                )
             )
-            db.add(prato_ingrediente)
 
         if payload.cardapio:
             for dia in payload.cardapio:
-                registro = BdCardapioSemanal(
-                    refeicao=refeicao,
-                    dia_da_semana=dia.dia_da_semana,
-                    tipo_refeicao=dia.tipo_refeicao,
+                refeicao.cardapios.append(
+                    BdCardapioSemanal(
+                        dia_da_semana=dia.dia_da_semana,
+                        tipo_refeicao=dia.tipo_refeicao,
+                    )
                 )
-                db.add(registro)
 
         db.commit()
-
-        refeicao_completa = (
-            db.execute(
-                select(BdRefeicao)
-                .options(
-                    selectinload(BdRefeicao.ingredientes).selectinload(BdPratoIngrediente.ingrediente),
-                    selectinload(BdRefeicao.cardapios),
-                )
-                .filter(BdRefeicao.id_refeicao == refeicao.id_refeicao)
-            )
-            .scalars()
-            .first()
-        )
-
-        if refeicao_completa is None:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Falha ao carregar refeição criada.")
-
-        return refeicao_completa
     except HTTPException:
         db.rollback()
         raise
+    except IntegrityError as exc:
+        db.rollback()
+        if _violou_unicidade(exc):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Refeição já cadastrada") from None
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail="Dados da refeição inválidos"
+        ) from None
     except Exception as exc:  # pragma: no cover - log fallback
         db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(exc)) from exc
 
+    _invalidar_cache("cardapio")
+    return refeicao
+
 
 @app.get("/cardapio", response_model=List[CardapioRead])
-async def listar_cardapio(
+@cache(expire=CACHE_EXPIRACAO["curto"], namespace="cardapio", key_builder=_chave_cache)
+def listar_cardapio(
     dia: Optional[str] = None,
     tipo: Optional[str] = None,
     db: Session = Depends(get_db),
-) -> List[BdCardapioSemanal]:
-    stmt = select(BdCardapioSemanal).options(selectinload(BdCardapioSemanal.refeicao)).order_by(
+) -> List[CardapioRead]:
+    stmt = select(BdCardapioSemanal).options(*_opcoes_carregamento(joinedload(BdCardapioSemanal.refeicao))).order_by(
         BdCardapioSemanal.dia_da_semana, BdCardapioSemanal.tipo_refeicao
     )
 
@@ -332,4 +450,4 @@ async def listar_cardapio(
     if tipo:
         stmt = stmt.filter(BdCardapioSemanal.tipo_refeicao == tipo)
 
-    return db.execute(stmt).scalars().all()
+    return CARDAPIO_ADAPTER.validate_python(db.execute(stmt).scalars().all(), from_attributes=True)
@@ -1,39 +1,79 @@
 from __future__ import annotations
 
+import base64
 import hashlib
 import os
 from dataclasses import dataclass, field
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
 
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet, InvalidToken
-from sqlalchemy import CheckConstraint, Enum as SqlEnum, ForeignKey, Integer, Numeric, String, create_engine, inspect
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from sqlalchemy import (
+    CheckConstraint,
+    Enum as SqlEnum,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    and_,
+    bindparam,
+    create_engine,
+    event,
+    insert,
+    inspect,
+    lambda_stmt,
+    or_,
+    select,
+    tuple_,
+)
 from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column, relationship
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateTable
 from sqlalchemy.types import TypeDecorator
 
 
 DB_PATH = Path(__file__).with_name("bd_teste.sqlite")
 ALUNO_KEY_PATH = Path(__file__).with_name("aluno.key")
+# Versao gravada em `PRAGMA user_version`; cada incremento corresponde a uma migracao em `atualizar_esquema`.
+# `criar_tabelas` nao faz nada se o banco ja estiver nesta versao: novas tabelas ou indices tambem pedem incremento.
+VERSAO_ESQUEMA = 5
+# Bit alto de `user_version` marcando que o banco ja tem dados (de exemplo ou reais); o restante e a versao.
+BANCO_POPULADO = 1 << 16
+TAMANHO_NONCE = 12
 
 
 class Base(DeclarativeBase):
     pass
 
 
+def _chave_valida(chave_bytes: bytes) -> bool:
+    # Mesmo criterio do Fernet (32 bytes em base64 urlsafe) sem instanciar nenhuma cifra.
+    try:
+        return len(base64.urlsafe_b64decode(chave_bytes)) == 32
+    except (ValueError, TypeError):
+        return False
+
+
 def carregar_chave_encriptacao() -> bytes:
     chave_env = os.getenv("ALUNO_ENCRYPTION_KEY")
     if chave_env:
-        try:
-            chave_bytes = chave_env.encode("utf-8")
-            Fernet(chave_bytes)
-            return chave_bytes
-        except (ValueError, TypeError):
-            raise ValueError("ALUNO_ENCRYPTION_KEY inválida. Forneça uma chave Fernet válida.") from None
+        chave_bytes = chave_env.encode("utf-8")
+        if not _chave_valida(chave_bytes):
+            raise ValueError("ALUNO_ENCRYPTION_KEY inválida. Forneça uma chave Fernet válida.")
+        return chave_bytes
 
     if ALUNO_KEY_PATH.exists():
         chave_bytes = ALUNO_KEY_PATH.read_bytes()
-        Fernet(chave_bytes)
+        if not _chave_valida(chave_bytes):
+            raise ValueError(f"{ALUNO_KEY_PATH.name} inválida. Remova o arquivo para gerar uma nova chave.")
         return chave_bytes
 
     chave = Fernet.generate_key()
@@ -41,11 +81,50 @@ def carregar_chave_encriptacao() -> bytes:
     return chave
 
 
-FERNET = Fernet(carregar_chave_encriptacao())
+def _derivar_chave_aes(chave: bytes) -> bytes:
+    # Chave AES-256 propria, derivada uma unica vez; nao reutiliza diretamente os bytes da chave Fernet.
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"jandyr:aluno:aes-gcm").derive(chave)
+
+
+# Chave validada e cifra construidas uma unica vez por processo.
+CHAVE_ALUNO = carregar_chave_encriptacao()
+AES_GCM = AESGCM(_derivar_chave_aes(CHAVE_ALUNO))
+
+
+@lru_cache(maxsize=1)
+def _fernet_legado() -> Fernet:
+    # So e construido se aparecer um token gravado antes da migracao para AES-GCM (versao 3 do esquema).
+    return Fernet(CHAVE_ALUNO)
+
+
+def _criptografar(texto: str) -> str:
+    nonce = os.urandom(TAMANHO_NONCE)
+    token = nonce + AES_GCM.encrypt(nonce, texto.encode("utf-8"), None)
+    return base64.urlsafe_b64encode(token).decode("ascii")
+
+
+def _descriptografar_estrito(valor: str) -> str:
+    # Levanta ValueError se nem AES-GCM nem o Fernet legado abrirem o valor (usado pelas migracoes).
+    try:
+        token = base64.urlsafe_b64decode(valor)
+        return AES_GCM.decrypt(token[:TAMANHO_NONCE], token[TAMANHO_NONCE:], None).decode("utf-8")
+    except (InvalidTag, ValueError):
+        pass
+    try:
+        return _fernet_legado().decrypt(valor.encode("utf-8")).decode("utf-8")
+    except InvalidToken:
+        raise ValueError("valor nao pode ser descriptografado com a chave atual") from None
+
+
+def _descriptografar(valor: str) -> str:
+    try:
+        return _descriptografar_estrito(valor)
+    except ValueError:
+        return valor
 
 
 class EncryptedString(TypeDecorator[str]):
-    """TypeDecorator que criptografa dados sensíveis antes de persistir."""
+    """TypeDecorator que criptografa dados sensíveis (AES-GCM) antes de persistir."""
 
     impl = String(255)
     cache_ok = True
@@ -55,20 +134,15 @@ class EncryptedString(TypeDecorator[str]):
             return None
         if not isinstance(value, str):
             raise TypeError("EncryptedString espera valores do tipo str")
-        token = FERNET.encrypt(value.encode("utf-8"))
-        return token.decode("utf-8")
+        return _criptografar(value)
 
     def process_result_value(self, value: str | None, dialect):  # type: ignore[override]
         if value is None:
             return None
-        try:
-            texto = FERNET.decrypt(value.encode("utf-8"))
-            return texto.decode("utf-8")
-        except InvalidToken:
-            return value
+        return _descriptografar(value)
 
 
-class Alergeno(Enum):
+class Alergeno(str, Enum):
     GLUTEN = "Glúten"
     LACTOSE = "Lactose"
     OVO = "Ovo"
@@ -78,26 +152,45 @@ class Alergeno(Enum):
     FRUTOS_DO_MAR = "Frutos do mar"
 
 
-class Macronutriente(Enum):
+class Macronutriente(str, Enum):
     CARBOIDRATOS = "Carboidratos"
     PROTEINAS = "Proteínas"
     LIPIDIOS = "Lipídios"
 
 
+def _valores_enum(enum_cls: type[Enum]) -> list[str]:
+    # Grava o valor do membro ("Glúten"), o mesmo texto usado pela API, em vez do nome ("GLUTEN").
+    return [membro.value for membro in enum_cls]
+
+
 class BdIngrediente(Base):
     __tablename__ = "bd_ingredientes"
 
     id_ingrediente: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    nome: Mapped[str] = mapped_column(String(120), nullable=False)
+    nome: Mapped[str] = mapped_column(String(120), nullable=False, unique=True, index=True)
     valor_energetico: Mapped[int] = mapped_column(Integer, nullable=False)
-    alergenico: Mapped[Alergeno] = mapped_column(SqlEnum(Alergeno, name="alergenico_enum"), nullable=False)
-    macronutriente: Mapped[Macronutriente] = mapped_column(SqlEnum(Macronutriente, name="macronutriente_enum"), nullable=False)
-    quantidade: Mapped[float] = mapped_column(Numeric(10, 2), nullable=False)
+    alergenico: Mapped[Alergeno] = mapped_column(
+        SqlEnum(Alergeno, name="alergenico_enum", values_callable=_valores_enum, native_enum=False), nullable=False
+    )
+    macronutriente: Mapped[Macronutriente] = mapped_column(
+        SqlEnum(Macronutriente, name="macronutriente_enum", values_callable=_valores_enum, native_enum=False),
+        nullable=False,
+    )
+    # Quantidade e preco sao gravados como inteiros em centesimos (ex.: 8.50 -> 850).
+    quantidade_centesimos: Mapped[int] = mapped_column("quantidade", Integer, nullable=False)
     unidade_medida: Mapped[str] = mapped_column(String(20), nullable=False)
-    preco_medio: Mapped[float] = mapped_column(Numeric(10, 2), nullable=False)
+    preco_centavos: Mapped[int] = mapped_column("preco_medio", Integer, nullable=False)
 
     pratos: Mapped[list[BdPratoIngrediente]] = relationship(back_populates="ingrediente", cascade="all, delete-orphan")
 
+    @property
+    def quantidade(self) -> float:
+        return self.quantidade_centesimos / 100
+
+    @property
+    def preco_medio(self) -> float:
+        return self.preco_centavos / 100
+
     __table_args__ = (
         CheckConstraint("valor_energetico >= 0", name="ck_valor_energetico_nao_negativo"),
         CheckConstraint("quantidade >= 0", name="ck_quantidade_nao_negativa"),
@@ -109,7 +202,7 @@ class BdRefeicao(Base):
     __tablename__ = "bd_refeicoes"
 
     id_refeicao: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    nome_prato: Mapped[str] = mapped_column(String(120), nullable=False)
+    nome_prato: Mapped[str] = mapped_column(String(120), nullable=False, unique=True, index=True)
     descricao: Mapped[str | None] = mapped_column(String(255), nullable=True)
 
     ingredientes: Mapped[list[BdPratoIngrediente]] = relationship(back_populates="refeicao", cascade="all, delete-orphan")
@@ -120,14 +213,18 @@ class BdPratoIngrediente(Base):
     __tablename__ = "bd_pratos_ingredientes"
 
     id_prato_ingrediente: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    id_refeicao: Mapped[int] = mapped_column(ForeignKey("bd_refeicoes.id_refeicao", ondelete="CASCADE"), nullable=False)
-    id_ingrediente: Mapped[int] = mapped_column(ForeignKey("bd_ingredientes.id_ingrediente", ondelete="CASCADE"), nullable=False)
-    quantidade: Mapped[float] = mapped_column(Numeric(10, 2), nullable=False)
+    id_refeicao: Mapped[int] = mapped_column(ForeignKey("bd_refeicoes.id_refeicao", ondelete="CASCADE"), nullable=False, index=True)
+    id_ingrediente: Mapped[int] = mapped_column(ForeignKey("bd_ingredientes.id_ingrediente", ondelete="CASCADE"), nullable=False, index=True)
+    quantidade_centesimos: Mapped[int] = mapped_column("quantidade", Integer, nullable=False)
     unidade_medida: Mapped[str] = mapped_column(String(20), nullable=False)
 
     refeicao: Mapped[BdRefeicao] = relationship(back_populates="ingredientes")
     ingrediente: Mapped[BdIngrediente] = relationship(back_populates="pratos")
 
+    @property
+    def quantidade(self) -> float:
+        return self.quantidade_centesimos / 100
+
     __table_args__ = (
         CheckConstraint("quantidade >= 0", name="ck_prato_ingrediente_quantidade_nao_negativa"),
     )
@@ -137,12 +234,17 @@ class BdCardapioSemanal(Base):
     __tablename__ = "bd_cardapio_semanal"
 
     id_cardapio_semanal: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    id_refeicao: Mapped[int] = mapped_column(ForeignKey("bd_refeicoes.id_refeicao", ondelete="CASCADE"), nullable=False)
+    id_refeicao: Mapped[int] = mapped_column(ForeignKey("bd_refeicoes.id_refeicao", ondelete="CASCADE"), nullable=False, index=True)
     dia_da_semana: Mapped[str] = mapped_column(String(20), nullable=False)
     tipo_refeicao: Mapped[str] = mapped_column(String(40), nullable=False)
 
     refeicao: Mapped[BdRefeicao] = relationship(back_populates="cardapios")
 
+    __table_args__ = (
+        # Cobre o filtro/ordenacao de /cardapio e ja entrega o id da refeicao para o join.
+        Index("ix_cardapio_dia_tipo_ref", "dia_da_semana", "tipo_refeicao", "id_refeicao"),
+    )
+
 
 class BdTurma(Base):
     __tablename__ = "bd_turmas"
@@ -157,6 +259,8 @@ class BdTurma(Base):
     __table_args__ = (
         CheckConstraint("length(serie) > 0", name="ck_turma_serie_nao_vazia"),
         CheckConstraint("length(periodo) > 0", name="ck_turma_periodo_nao_vazio"),
+        # Chave usada por _obter_ou_criar_turmas.
+        Index("ix_turma_serie_periodo_nome", "serie", "periodo", "nome_turma", unique=True),
     )
 
 
@@ -166,7 +270,7 @@ class BdAluno(Base):
     id_aluno: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     nome: Mapped[str] = mapped_column(EncryptedString(255), nullable=False)
     ra: Mapped[str] = mapped_column(EncryptedString(255), nullable=False)
-    ra_hash: Mapped[str] = mapped_column(String(64), nullable=False, unique=True)
+    ra_hash: Mapped[bytes] = mapped_column(LargeBinary(32), nullable=False, unique=True)
     serie: Mapped[str] = mapped_column(String(40), nullable=False)
     periodo: Mapped[str] = mapped_column(String(40), nullable=False)
     observacoes: Mapped[str | None] = mapped_column(String(500), nullable=True)
@@ -175,12 +279,15 @@ class BdAluno(Base):
     turma: Mapped[BdTurma | None] = relationship(back_populates="alunos")
     alergias: Mapped[list["BdAlunoAlergia"]] = relationship(back_populates="aluno", cascade="all, delete-orphan")
     hobbies: Mapped[list["BdAlunoHobbie"]] = relationship(back_populates="aluno", cascade="all, delete-orphan")
-    dificuldades: Mapped[list["BdAlunoDificuldade"]] = relationship(back_populates="aluno", cascade="all, delete-orphan")
+    dificuldades: Mapped[list["BdAlunoDificuldade"]] = relationship(
+        back_populates="aluno", cascade="all, delete-orphan", order_by="BdAlunoDificuldade.ordem"
+    )
 
     __table_args__ = (
         CheckConstraint("length(serie) > 0", name="ck_aluno_serie_nao_vazia"),
         CheckConstraint("length(periodo) > 0", name="ck_aluno_periodo_nao_vazio"),
-        CheckConstraint("length(ra_hash) = 64", name="ck_aluno_ra_hash_tamanho"),
+        CheckConstraint("length(ra_hash) = 32", name="ck_aluno_ra_hash_tamanho"),
+        Index("ix_aluno_serie_periodo", "serie", "periodo"),
     )
 
 
@@ -250,108 +357,286 @@ class NovoAluno:
     nome_turma: str | None = None
 
 
-def _hash_texto(valor: str) -> str:
-    return hashlib.sha256(valor.encode("utf-8")).hexdigest()
+def para_centesimos(valor: float | Decimal) -> int:
+    # Decimal (entrada da API, ja com duas casas) converte direto; so float passa por str() para evitar
+    # artefatos binarios. Meio centesimo arredonda para cima (0.125 -> 13).
+    centesimos = (valor if isinstance(valor, Decimal) else Decimal(str(valor))) * 100
+    if centesimos == centesimos.to_integral_value():
+        return int(centesimos)
+    return int(centesimos.quantize(Decimal("1"), ROUND_HALF_UP))
+
+
+@lru_cache(maxsize=4096)
+def _hash_texto(valor: str) -> bytes:
+    return hashlib.sha256(valor.encode("utf-8")).digest()
+
+
+def _hash_migrado(id_aluno: int, ra: str, ra_hash_hex: str | None) -> bytes:
+    # O hash hexadecimal existente ja e o SHA-256 do RA: so muda de formato. O RA so e descriptografado
+    # (sem fallback) quando o hash falta, para nunca gravar o hash de um token ilegivel.
+    if ra_hash_hex:
+        return bytes.fromhex(ra_hash_hex)
+    try:
+        return _hash_texto(_descriptografar_estrito(ra))
+    except ValueError:
+        raise ValueError(
+            f"Aluno {id_aluno} sem ra_hash e com RA que a chave atual nao descriptografa; migracao abortada."
+        ) from None
+
+
+def _recriar_tabela_alunos(conn) -> None:
+    # SQLite nao altera tipo nem CHECK de coluna existente: a tabela e recriada com a definicao atual do modelo.
+    # Os indices sao recriados depois, junto com os demais declarados nos modelos.
+    tabela = BdAluno.__table__
+    auxiliar = MetaData()
+    BdTurma.__table__.to_metadata(auxiliar)
+    nova = tabela.to_metadata(auxiliar, name="bd_alunos_v4")
+    # SQL direto para copiar nome/RA ja criptografados sem passar de novo pelo EncryptedString.
+    colunas = [col.name for col in tabela.columns if col.name != "ra_hash"]
+    colunas_antigas = {linha[1] for linha in conn.exec_driver_sql("PRAGMA table_info(bd_alunos)")}
+    hash_antigo = "ra_hash" if "ra_hash" in colunas_antigas else "NULL"
+    linhas = conn.exec_driver_sql(f"SELECT {', '.join(colunas)}, {hash_antigo} FROM bd_alunos").all()
+    posicao_ra = colunas.index("ra")
+
+    conn.execute(CreateTable(nova))
+    if linhas:
+        conn.exec_driver_sql(
+            f"INSERT INTO bd_alunos_v4 ({', '.join(colunas)}, ra_hash) VALUES ({', '.join('?' * (len(colunas) + 1))})",
+            [(*linha[:-1], _hash_migrado(linha[0], linha[posicao_ra], linha[-1])) for linha in linhas],
+        )
+    conn.exec_driver_sql("DROP TABLE bd_alunos")
+    conn.exec_driver_sql("ALTER TABLE bd_alunos_v4 RENAME TO bd_alunos")
+
+
+def _duplicatas(conn, indice: Index) -> str | None:
+    # Bancos antigos nao exigiam nomes unicos: aponta as duplicatas em vez de falhar com um IntegrityError generico.
+    # NULL nao conflita em indice UNIQUE, entao linhas com coluna nula ficam de fora.
+    colunas = [coluna.name for coluna in indice.columns]
+    lista = ", ".join(colunas)
+    repetidos = conn.exec_driver_sql(
+        f"SELECT {lista}, count(*) FROM {indice.table.name} "
+        f"WHERE {' AND '.join(f'{coluna} IS NOT NULL' for coluna in colunas)} "
+        f"GROUP BY {lista} HAVING count(*) > 1"
+    ).all()
+    if not repetidos:
+        return None
+    valores = "; ".join(f"{', '.join(map(repr, linha[:-1]))} ({linha[-1]}x)" for linha in repetidos)
+    return f"{indice.name} em {indice.table.name}({lista}): {valores}"
 
 
 def atualizar_esquema(engine) -> None:
     insp = inspect(engine)
-    if "bd_alunos" not in insp.get_table_names():
-        return
-
-    colunas_info = insp.get_columns("bd_alunos")
-    colunas = {col["name"] for col in colunas_info}
-    adicionou_coluna = False
-
-    if "ra_hash" not in colunas:
-        with engine.begin() as conn:
-            conn.exec_driver_sql("ALTER TABLE bd_alunos ADD COLUMN ra_hash VARCHAR(64)")
-        adicionou_coluna = True
-        colunas_info = insp.get_columns("bd_alunos")
-
-    info_ra_hash = next((col for col in colunas_info if col["name"] == "ra_hash"), None)
-    if info_ra_hash is None:
-        return
-
-    if adicionou_coluna or info_ra_hash.get("nullable", True):
-        with Session(engine) as session:
-            alunos_sem_hash = (
-                session.query(BdAluno)
-                .filter((BdAluno.ra_hash.is_(None)) | (BdAluno.ra_hash == ""))
-                .all()
-            )
-            for aluno in alunos_sem_hash:
-                if aluno.ra:
-                    aluno.ra_hash = _hash_texto(aluno.ra)
-            session.commit()
+    tabelas = set(insp.get_table_names())
 
     with engine.begin() as conn:
-        conn.exec_driver_sql(
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_bd_alunos_ra_hash ON bd_alunos (ra_hash)"
-        )
-
-
-def _obter_ou_criar_turma(session: Session, serie: str, periodo: str, nome_turma: str | None) -> BdTurma:
-    consulta = session.query(BdTurma).filter(BdTurma.serie == serie, BdTurma.periodo == periodo)
-    if nome_turma is None:
-        consulta = consulta.filter(BdTurma.nome_turma.is_(None))
-    else:
-        consulta = consulta.filter(BdTurma.nome_turma == nome_turma)
+        # Transacao explicita: o pysqlite nao abre uma antes de DDL/PRAGMA, e tudo abaixo (migracoes, indices e
+        # a nova versao) precisa valer junto ou nao valer. IMMEDIATE faz um segundo processo esperar e reler a versao.
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        marcadores = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        versao = marcadores & ~BANCO_POPULADO
+        if versao < 1 and {"bd_ingredientes", "bd_pratos_ingredientes"} <= tabelas:
+            # Versao 1: quantidades e precos deixam de ser NUMERIC(10, 2) e passam a inteiros em centesimos.
+            # Convertidos por `para_centesimos` (e nao ROUND do SQLite) para arredondar como a API e os exemplos.
+            ingredientes = conn.exec_driver_sql("SELECT id_ingrediente, quantidade, preco_medio FROM bd_ingredientes").all()
+            if ingredientes:
+                conn.exec_driver_sql(
+                    "UPDATE bd_ingredientes SET quantidade = ?, preco_medio = ? WHERE id_ingrediente = ?",
+                    [
+                        (para_centesimos(quantidade), para_centesimos(preco), id_ingrediente)
+                        for id_ingrediente, quantidade, preco in ingredientes
+                    ],
+                )
+            itens = conn.exec_driver_sql("SELECT id_prato_ingrediente, quantidade FROM bd_pratos_ingredientes").all()
+            if itens:
+                conn.exec_driver_sql(
+                    "UPDATE bd_pratos_ingredientes SET quantidade = ? WHERE id_prato_ingrediente = ?",
+                    [(para_centesimos(quantidade), id_item) for id_item, quantidade in itens],
+                )
+        if versao < 2:
+            # Versao 2: ix_cardapio_dia_tipo foi substituido pelo indice de cobertura ix_cardapio_dia_tipo_ref.
+            conn.exec_driver_sql("DROP INDEX IF EXISTS ix_cardapio_dia_tipo")
+        if versao < 3 and "bd_alunos" in tabelas:
+            # Versao 3: nome e RA dos alunos deixam de usar Fernet e passam a AES-GCM.
+            # Valores que a chave atual nao abre ficam como estao, em vez de terem o token embrulhado em AES-GCM.
+            alunos = conn.exec_driver_sql("SELECT id_aluno, nome, ra FROM bd_alunos").all()
+            for coluna, posicao in (("nome", 1), ("ra", 2)):
+                recriptografados = []
+                for aluno in alunos:
+                    try:
+                        recriptografados.append((_criptografar(_descriptografar_estrito(aluno[posicao])), aluno[0]))
+                    except ValueError:
+                        continue
+                if recriptografados:
+                    conn.exec_driver_sql(f"UPDATE bd_alunos SET {coluna} = ? WHERE id_aluno = ?", recriptografados)
+        if versao < 4 and "bd_alunos" in tabelas:
+            # Versao 4: ra_hash passa de 64 caracteres hexadecimais a 32 bytes do digest SHA-256.
+            _recriar_tabela_alunos(conn)
+        if versao < 5 and "bd_ingredientes" in tabelas:
+            # Versao 5: alergenico e macronutriente passam a guardar o valor do enum em vez do nome.
+            for coluna, enum_cls in (("alergenico", Alergeno), ("macronutriente", Macronutriente)):
+                conn.exec_driver_sql(
+                    f"UPDATE bd_ingredientes SET {coluna} = ? WHERE {coluna} = ?",
+                    [(membro.value, membro.name) for membro in enum_cls],
+                )
 
-    turma = consulta.first()
-    if turma is None:
-        turma = BdTurma(nome_turma=nome_turma, serie=serie, periodo=periodo)
-        session.add(turma)
+        # create_all nao altera tabelas existentes; garante os indices declarados nos modelos.
+        indices = [indice for tabela in Base.metadata.sorted_tables if tabela.name in tabelas for indice in tabela.indexes]
+        conflitos = [conflito for indice in indices if indice.unique and (conflito := _duplicatas(conn, indice))]
+        if conflitos:
+            raise ValueError(
+                "Nao e possivel criar os indices unicos; remova ou renomeie as duplicatas e inicie de novo: "
+                + " | ".join(conflitos)
+            )
+        for indice in indices:
+            indice.create(conn, checkfirst=True)
+
+        # Por ultimo: se algo acima falhar, a versao nao avanca e a migracao roda de novo na proxima partida.
+        if versao < VERSAO_ESQUEMA:
+            conn.exec_driver_sql(f"PRAGMA user_version = {VERSAO_ESQUEMA | (marcadores & BANCO_POPULADO)}")
+
+
+def _inserir_em_lote(session: Session, modelo: type[Base], linhas: list[dict]) -> None:
+    # Um unico INSERT (executemany) para linhas filhas que nao precisam voltar como objetos ORM.
+    if linhas:
+        session.execute(insert(modelo), linhas)
+
+
+def _textos_preenchidos(itens: list[str]) -> list[str]:
+    # Filtra antes de numerar: itens em branco nao deixam buracos na `ordem` das dificuldades.
+    return [texto for texto in map(str.strip, itens) if texto]
+
+
+def _obter_ou_criar_turmas(
+    session: Session, chaves: set[tuple[str, str, str | None]]
+) -> dict[tuple[str, str, str | None], BdTurma]:
+    # Uma consulta para todas as turmas; NULL nao casa em IN, entao turmas sem nome vao por (serie, periodo).
+    com_nome = [chave for chave in chaves if chave[2] is not None]
+    sem_nome = [(serie, periodo) for serie, periodo, nome_turma in chaves if nome_turma is None]
+    condicoes = []
+    if com_nome:
+        condicoes.append(tuple_(BdTurma.serie, BdTurma.periodo, BdTurma.nome_turma).in_(com_nome))
+    if sem_nome:
+        condicoes.append(and_(BdTurma.nome_turma.is_(None), tuple_(BdTurma.serie, BdTurma.periodo).in_(sem_nome)))
+
+    turmas: dict[tuple[str, str, str | None], BdTurma] = {}
+    if condicoes:
+        for turma in session.scalars(select(BdTurma).where(or_(*condicoes))):
+            turmas.setdefault((turma.serie, turma.periodo, turma.nome_turma), turma)
+
+    novas = [
+        BdTurma(nome_turma=nome_turma, serie=serie, periodo=periodo)
+        for serie, periodo, nome_turma in chaves
+        if (serie, periodo, nome_turma) not in turmas
+    ]
+    if novas:
+        session.add_all(novas)
         session.flush()
+        turmas.update({(turma.serie, turma.periodo, turma.nome_turma): turma for turma in novas})
 
-    return turma
+    return turmas
 
 
 def cadastrar_aluno(engine, aluno: NovoAluno) -> None:
-    with Session(engine) as session:
-        turma = _obter_ou_criar_turma(session, aluno.serie, aluno.periodo, aluno.nome_turma)
+    cadastrar_alunos(engine, [aluno])
+
 
-        ra_hash = _hash_texto(aluno.ra)
-        existente = session.query(BdAluno).filter(BdAluno.ra_hash == ra_hash).first()
-        if existente:
+def cadastrar_alunos(engine, alunos: list[NovoAluno]) -> None:
+    # Todos os alunos em uma unica transacao: se algum RA ja existir, nenhum e cadastrado.
+    ra_hashes = [_hash_texto(aluno.ra) for aluno in alunos]
+    if len(set(ra_hashes)) != len(ra_hashes):
+        raise ValueError("Aluno com este RA já está cadastrado.")
+
+    with Session(engine) as session:
+        # Consulta so os hashes: nao carrega nem descriptografa nome/RA para testar existencia.
+        existente = session.scalar(select(BdAluno.ra_hash).where(BdAluno.ra_hash.in_(ra_hashes)).limit(1))
+        if existente is not None:
             raise ValueError("Aluno com este RA já está cadastrado.")
 
-        novo_aluno = BdAluno(
-            nome=aluno.nome,
-            ra=aluno.ra,
-            ra_hash=ra_hash,
-            serie=aluno.serie,
-            periodo=aluno.periodo,
-            observacoes=aluno.observacoes,
-            turma=turma,
-        )
-        session.add(novo_aluno)
+        turmas = _obter_ou_criar_turmas(session, {(aluno.serie, aluno.periodo, aluno.nome_turma) for aluno in alunos})
+
+        novos_alunos = [
+            BdAluno(
+                nome=aluno.nome,
+                ra=aluno.ra,
+                ra_hash=ra_hash,
+                serie=aluno.serie,
+                periodo=aluno.periodo,
+                observacoes=aluno.observacoes,
+                turma=turmas[(aluno.serie, aluno.periodo, aluno.nome_turma)],
+            )
+            for aluno, ra_hash in zip(alunos, ra_hashes)
+        ]
+        session.add_all(novos_alunos)
         session.flush()
 
-        for descricao in aluno.alergias:
-            texto = descricao.strip()
-            if texto:
-                session.add(BdAlunoAlergia(aluno=novo_aluno, descricao=texto))
+        pares = [(novo.id_aluno, aluno) for novo, aluno in zip(novos_alunos, alunos)]
+        _inserir_em_lote(
+            session,
+            BdAlunoAlergia,
+            [
+                {"id_aluno": id_aluno, "descricao": texto}
+                for id_aluno, aluno in pares
+                for texto in _textos_preenchidos(aluno.alergias)
+            ],
+        )
+        _inserir_em_lote(
+            session,
+            BdAlunoHobbie,
+            [
+                {"id_aluno": id_aluno, "descricao": texto}
+                for id_aluno, aluno in pares
+                for texto in _textos_preenchidos(aluno.hobbies)
+            ],
+        )
+        _inserir_em_lote(
+            session,
+            BdAlunoDificuldade,
+            [
+                {"id_aluno": id_aluno, "descricao": texto, "ordem": indice}
+                for id_aluno, aluno in pares
+                for indice, texto in enumerate(_textos_preenchidos(aluno.dificuldades), start=1)
+            ],
+        )
 
-        for descricao in aluno.hobbies:
-            texto = descricao.strip()
-            if texto:
-                session.add(BdAlunoHobbie(aluno=novo_aluno, descricao=texto))
+        session.commit()
 
-        for indice, descricao in enumerate(aluno.dificuldades, start=1):
-            texto = descricao.strip()
-            if texto:
-                session.add(BdAlunoDificuldade(aluno=novo_aluno, descricao=texto, ordem=indice))
 
-        session.commit()
+def _configurar_sqlite(dbapi_conn, _registro) -> None:
+    # WAL permite leituras concorrentes com escrita; NORMAL agrupa os fsyncs; mmap/cache mantem paginas quentes.
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
 
 
 def criar_engine(echo: bool = False):
-    engine = create_engine(f"sqlite:///{DB_PATH}", echo=echo, future=True)
+    engine = create_engine(
+        f"sqlite:///{DB_PATH}",
+        echo=echo,
+        future=True,
+        # Cache de SQL compilado maior que o padrao (500) e INSERTs em lote em paginas de ate 1000 linhas.
+        query_cache_size=1200,
+        insertmanyvalues_page_size=1000,
+        connect_args={"check_same_thread": False},
+        # Pool fixo: as conexoes (com PRAGMAs e cache de paginas ja aquecidos) sao reaproveitadas entre
+        # requisicoes; sem overflow, picos esperam uma conexao livre em vez de abrir e fechar novas.
+        poolclass=QueuePool,
+        pool_size=10,
+        max_overflow=0,
+    )
+    event.listen(engine, "connect", _configurar_sqlite)
     return engine
 
 
 def criar_tabelas(engine) -> None:
+    # Banco ja na versao atual: pula create_all e a introspeccao de cada tabela.
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA user_version").scalar() & ~BANCO_POPULADO == VERSAO_ESQUEMA:
+            return
+
     Base.metadata.create_all(engine)
     atualizar_esquema(engine)
 
@@ -363,18 +648,18 @@ def preencher_dados_exemplo(engine) -> None:
             valor_energetico=389,
             alergenico=Alergeno.GLUTEN,
             macronutriente=Macronutriente.CARBOIDRATOS,
-            quantidade=Decimal("100"),
+            quantidade_centesimos=para_centesimos(100),
             unidade_medida="g",
-            preco_medio=Decimal("8.50"),
+            preco_centavos=para_centesimos(8.50),
         )
         leite = BdIngrediente(
             nome="Leite integral",
             valor_energetico=61,
             alergenico=Alergeno.LACTOSE,
             macronutriente=Macronutriente.PROTEINAS,
-            quantidade=Decimal("200"),
+            quantidade_centesimos=para_centesimos(200),
             unidade_medida="ml",
-            preco_medio=Decimal("4.20"),
+            preco_centavos=para_centesimos(4.20),
         )
 
         mingau = BdRefeicao(nome_prato="Mingau de aveia", descricao="Aveia cozida em leite integral")
@@ -387,13 +672,13 @@ def preencher_dados_exemplo(engine) -> None:
                 BdPratoIngrediente(
                     refeicao=mingau,
                     ingrediente=aveia,
-                    quantidade=Decimal("40"),
+                    quantidade_centesimos=para_centesimos(40),
                     unidade_medida="g",
                 ),
                 BdPratoIngrediente(
                     refeicao=mingau,
                     ingrediente=leite,
-                    quantidade=Decimal("200"),
+                    quantidade_centesimos=para_centesimos(200),
                     unidade_medida="ml",
                 ),
             ]
@@ -442,10 +727,10 @@ def criar_cardapio(engine, refeicao: NovaRefeicao, agenda: list[tuple[str, str]]
 
         nomes = {ingr.nome for ingr, _, _ in refeicao.ingredientes}
         if nomes:
-            existentes = (
-                session.query(BdIngrediente)
-                .filter(BdIngrediente.nome.in_(nomes))
-                .all()
+            # lambda_stmt guarda a consulta ja montada e compilada; o IN expansivel serve qualquer quantidade de nomes.
+            existentes = session.scalars(
+                lambda_stmt(lambda: select(BdIngrediente).where(BdIngrediente.nome.in_(bindparam("nomes", expanding=True)))),
+                {"nomes": list(nomes)},
             )
             ingredientes_bd.update({ing.nome: ing for ing in existentes})
 
@@ -456,9 +741,9 @@ def criar_cardapio(engine, refeicao: NovaRefeicao, agenda: list[tuple[str, str]]
                     valor_energetico=ingr.valor_energetico,
                     alergenico=ingr.alergenico,
                     macronutriente=ingr.macronutriente,
-                    quantidade=Decimal(str(ingr.quantidade)),
+                    quantidade_centesimos=para_centesimos(ingr.quantidade),
                     unidade_medida=ingr.unidade_medida,
-                    preco_medio=Decimal(str(ingr.preco_medio)),
+                    preco_centavos=para_centesimos(ingr.preco_medio),
                 )
                 session.add(novo)
                 ingredientes_bd[ingr.nome] = novo
@@ -467,19 +752,24 @@ def criar_cardapio(engine, refeicao: NovaRefeicao, agenda: list[tuple[str, str]]
         session.add(prato)
         session.flush()
 
-        for ingr, qtd, unidade in refeicao.ingredientes:
-            bd_ingr = ingredientes_bd[ingr.nome]
-            session.add(
-                BdPratoIngrediente(
-                    refeicao=prato,
-                    ingrediente=bd_ingr,
-                    quantidade=Decimal(str(qtd)),
-                    unidade_medida=unidade,
-                )
-            )
-
-        for dia, tipo in agenda:
-            session.add(BdCardapioSemanal(refeicao=prato, dia_da_semana=dia, tipo_refeicao=tipo))
+        _inserir_em_lote(
+            session,
+            BdPratoIngrediente,
+            [
+                {
+                    "id_refeicao": prato.id_refeicao,
+                    "id_ingrediente": ingredientes_bd[ingr.nome].id_ingrediente,
+                    "quantidade_centesimos": para_centesimos(qtd),
+                    "unidade_medida": unidade,
+                }
+                for ingr, qtd, unidade in refeicao.ingredientes
+            ],
+        )
+        _inserir_em_lote(
+            session,
+            BdCardapioSemanal,
+            [{"id_refeicao": prato.id_refeicao, "dia_da_semana": dia, "tipo_refeicao": tipo} for dia, tipo in agenda],
+        )
 
         session.commit()
 
@@ -488,12 +778,18 @@ def main() -> None:
     engine = criar_engine()
     criar_tabelas(engine)
 
-    with Session(engine) as session:
-        tem_dados = session.query(BdIngrediente.id_ingrediente).first() is not None
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA user_version").scalar() & BANCO_POPULADO:
+            return
+        # Bancos anteriores ao marcador: confere os dados uma unica vez.
+        tem_dados = conn.scalar(select(BdIngrediente.id_ingrediente).limit(1)) is not None
 
     if not tem_dados:
         preencher_dados_exemplo(engine)
 
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"PRAGMA user_version = {VERSAO_ESQUEMA | BANCO_POPULADO}")
+
 
 if __name__ == "__main__":
     main()
@@ -2,16 +2,23 @@ from __future__ import annotations
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 from uuid import uuid4
 
 import requests
-from sqlalchemy.orm import Session
+from requests.adapters import HTTPAdapter
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, joinedload, selectinload
 
 from db_setup import BdAluno, BdCardapioSemanal, BdRefeicao, NovoAluno, cadastrar_aluno, criar_engine, criar_tabelas
 
 BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:8000")
 
+# Sessao unica: reaproveita conexoes (keep-alive) entre as chamadas, inclusive nas GETs paralelas.
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=8))
+
 
 def _check_response(response: requests.Response, context: str) -> dict | list:
     try:
@@ -31,7 +38,7 @@ def _check_response(response: requests.Response, context: str) -> dict | list:
 
 def testar_api() -> None:
     print("== Testando API ==")
-    raiz = _check_response(requests.get(BASE_URL, timeout=5), "GET /")
+    raiz = _check_response(SESSION.get(BASE_URL, timeout=5), "GET /")
     print("Guia da raiz:")
     pprint(raiz)
 
@@ -59,14 +66,11 @@ def testar_api() -> None:
 
     ingredientes_criados = []
     for payload in ingredientes_payload:
-        resp = _check_response(requests.post(f"{BASE_URL}/ingredientes", json=payload, timeout=5), "POST /ingredientes")
+        resp = _check_response(SESSION.post(f"{BASE_URL}/ingredientes", json=payload, timeout=5), "POST /ingredientes")
         ingredientes_criados.append(resp)
     print("Ingredientes criados:")
     pprint(ingredientes_criados)
 
-    lista_ingredientes = _check_response(requests.get(f"{BASE_URL}/ingredientes", timeout=5), "GET /ingredientes")
-    print("Total de ingredientes cadastrados:", len(lista_ingredientes))
-
     refeicao_payload = {
         "nome_prato": f"Bowl Energético {sufixo}",
         "descricao": "Quinoa e grão-de-bico com temperos leves.",
@@ -80,20 +84,23 @@ def testar_api() -> None:
         ],
     }
 
-    refeicao_criada = _check_response(requests.post(f"{BASE_URL}/refeicoes", json=refeicao_payload, timeout=5), "POST /refeicoes")
+    refeicao_criada = _check_response(SESSION.post(f"{BASE_URL}/refeicoes", json=refeicao_payload, timeout=5), "POST /refeicoes")
     print("Refeição criada:")
     pprint(refeicao_criada)
 
-    refeicoes = _check_response(requests.get(f"{BASE_URL}/refeicoes", timeout=5), "GET /refeicoes")
-    print("Total de refeições cadastradas:", len(refeicoes))
-
-    cardapio = _check_response(requests.get(f"{BASE_URL}/cardapio", timeout=5), "GET /cardapio")
-    print("Registros do cardápio semanal:", len(cardapio))
-    cardapio_filtro = _check_response(
-        requests.get(f"{BASE_URL}/cardapio", params={"dia": "Terça"}, timeout=5),
-        "GET /cardapio?dia=Terça",
-    )
-    print("Registros no cardápio para Terça:", len(cardapio_filtro))
+    # As leituras nao dependem umas das outras: disparadas em paralelo, verificadas na ordem.
+    leituras = [
+        ("/ingredientes", None, "GET /ingredientes", "Total de ingredientes cadastrados:"),
+        ("/refeicoes", None, "GET /refeicoes", "Total de refeições cadastradas:"),
+        ("/cardapio", None, "GET /cardapio", "Registros do cardápio semanal:"),
+        ("/cardapio", {"dia": "Terça"}, "GET /cardapio?dia=Terça", "Registros no cardápio para Terça:"),
+    ]
+    with ThreadPoolExecutor(max_workers=len(leituras)) as executor:
+        respostas = list(
+            executor.map(lambda leitura: SESSION.get(f"{BASE_URL}{leitura[0]}", params=leitura[1], timeout=5), leituras)
+        )
+    for (_, _, contexto, rotulo), resposta in zip(leituras, respostas):
+        print(rotulo, len(_check_response(resposta, contexto)))
 
 
 def testar_banco() -> None:
@@ -118,12 +125,19 @@ def testar_banco() -> None:
     print(f"Aluno {novo_aluno.nome} cadastrado com sucesso.")
 
     with Session(engine) as session:
-        aluno_db = (
-            session.query(BdAluno)
-            .filter(BdAluno.serie == novo_aluno.serie, BdAluno.periodo == novo_aluno.periodo)
+        # Turma no mesmo SELECT; as tres listas em um SELECT ... IN cada, sem lazy load por atributo.
+        aluno_db = session.execute(
+            select(BdAluno)
+            .options(
+                joinedload(BdAluno.turma),
+                selectinload(BdAluno.alergias),
+                selectinload(BdAluno.hobbies),
+                selectinload(BdAluno.dificuldades),
+            )
+            .where(BdAluno.serie == novo_aluno.serie, BdAluno.periodo == novo_aluno.periodo)
             .order_by(BdAluno.id_aluno.desc())
-            .first()
-        )
+            .limit(1)
+        ).scalar_one_or_none()
         if aluno_db is None:
             raise RuntimeError("Aluno recém-cadastrado não encontrado no banco.")
 
@@ -142,12 +156,17 @@ def testar_banco() -> None:
 
         alergias = [a.descricao for a in aluno_db.alergias]
         hobbies = [h.descricao for h in aluno_db.hobbies]
-        dificuldades = [d.descricao for d in sorted(aluno_db.dificuldades, key=lambda item: item.ordem)]
+        dificuldades = [d.descricao for d in aluno_db.dificuldades]
         print("Listas associadas:")
         pprint({"alergias": alergias, "hobbies": hobbies, "dificuldades": dificuldades})
 
-    total_cardapio = session.query(BdCardapioSemanal).count()
-    total_refeicoes = session.query(BdRefeicao).count()
+        # As duas contagens em um unico SELECT, ainda dentro da sessao aberta.
+        total_cardapio, total_refeicoes = session.execute(
+            select(
+                select(func.count()).select_from(BdCardapioSemanal).scalar_subquery(),
+                select(func.count()).select_from(BdRefeicao).scalar_subquery(),
+            )
+        ).one()
     print(f"Resumo: {total_cardapio} entradas de cardápio e {total_refeicoes} refeições registradas.")
 
 